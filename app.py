@@ -4,17 +4,22 @@ A gamified learning tool that converts YouTube videos into interactive quizzes
 """
 
 import streamlit as st
-import time
-from utils.transcript import get_transcript, get_video_metadata
+import io
+import hashlib
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from utils.transcript import extract_video_id, get_transcript, get_video_metadata
 from utils.llm import generate_notes, format_notes_for_display
 from utils.quiz import (
     generate_questions, 
     select_quiz_questions, 
+    build_topic_index,
     check_answer,
     calculate_topic_performance,
     get_weak_topics
 )
 from utils.storage import SessionStorage
+from utils.semantic_cache import embed_transcript, find_similar, confirm_match
 from utils.pdf_generator import generate_pdf
 
 # Page configuration
@@ -25,8 +30,8 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS
-st.markdown("""
+# Custom CSS (emitted from main() on every run)
+APP_CSS = """
 <style>
     .main-header {
         text-align: center;
@@ -86,7 +91,47 @@ st.markdown("""
         font-size: 16px;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Quiz mode cards (static HTML)
+QUICK_PLAY_CARD = """
+<div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+            padding: 20px; border-radius: 10px; text-align: center; color: white;
+            box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);'>
+    <h2 style='margin:0; font-size: 2.5em;'>🎮</h2>
+    <h3 style='margin: 10px 0;'>Quick Play</h3>
+    <p style='margin: 5px 0; font-size: 1.1em;'>5 questions</p>
+    <p style='margin: 5px 0;'>⏱️ ~5 minutes</p>
+</div>
+"""
+
+STANDARD_CARD = """
+<div style='background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); 
+            padding: 20px; border-radius: 10px; text-align: center; color: white;
+            box-shadow: 0 4px 12px rgba(240, 147, 251, 0.3);'>
+    <h2 style='margin:0; font-size: 2.5em;'>📚</h2>
+    <h3 style='margin: 10px 0;'>Standard</h3>
+    <p style='margin: 5px 0; font-size: 1.1em;'>15 questions</p>
+    <p style='margin: 5px 0;'>⏱️ ~15 minutes</p>
+</div>
+"""
+
+CHALLENGE_CARD = """
+<div style='background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); 
+            padding: 20px; border-radius: 10px; text-align: center; color: white;
+            box-shadow: 0 4px 12px rgba(79, 172, 254, 0.3);'>
+    <h2 style='margin:0; font-size: 2.5em;'>🏆</h2>
+    <h3 style='margin: 10px 0;'>Challenge</h3>
+    <p style='margin: 5px 0; font-size: 1.1em;'>30 questions</p>
+    <p style='margin: 5px 0;'>⏱️ ~30 minutes</p>
+</div>
+"""
+
+
+# Session state keys owned by the app (reset when starting over)
+_APP_KEYS = ('page', 'video_data', 'quiz_data', 'current_question', 'score', 'answers', 'show_feedback',
+             'questions_future')
+
 
 # Initialize session state
 def init_session_state():
@@ -105,10 +150,111 @@ def init_session_state():
     if 'show_feedback' not in st.session_state:
         st.session_state.show_feedback = False
 
+
+def reset_session_state():
+    """Clear the app's own keys and start over, leaving Streamlit's widget state alone"""
+    for key in _APP_KEYS:
+        st.session_state.pop(key, None)
+    init_session_state()
+
+
 init_session_state()
 
+@st.cache_resource
+def get_executor():
+    """Thread pool shared by all sessions for background question generation"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="questions")
+
+
+def generate_and_save_questions(session_storage, video_id, transcript, notes, embedding):
+    """Background job: generate the question pool, then cache the full session"""
+    try:
+        questions_result = generate_questions(notes, num_questions=50)
+        if not questions_result['success']:
+            return questions_result
+        
+        # Never cache an empty pool; the fast path would serve it forever
+        if not questions_result['questions']:
+            return {
+                'success': False,
+                'error': 'No questions could be generated from these notes.'
+            }
+        
+        session_storage.save_session(video_id, transcript, notes, questions_result['questions'], embedding=embedding)
+        return questions_result
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'Error generating questions: {str(e)}'
+        }
+
+
+@st.cache_resource
+def get_storage():
+    """One SessionStorage (and SQLite connection) for the whole server process"""
+    return SessionStorage()
+
+
 # Storage instance
-storage = SessionStorage()
+storage = get_storage()
+
+
+def submit_questions_job():
+    """Start (or restart) background question generation for the current video"""
+    video_data = st.session_state.video_data
+    st.session_state.quiz_data.pop('questions_error', None)
+    st.session_state.questions_future = get_executor().submit(
+        generate_and_save_questions,
+        storage,
+        video_data['video_id'],
+        video_data['transcript'],
+        video_data['notes'],
+        video_data.get('embedding')
+    )
+
+
+def notes_fingerprint(notes):
+    """Content hash of the notes, so caches keyed on it never serve stale output"""
+    return hashlib.sha1(orjson.dumps(notes)).hexdigest()
+
+
+# PDFs are kept in server memory, so only the most recent ones are cached
+@st.cache_data(show_spinner=False, max_entries=32, ttl=3600)
+def get_notes_pdf(video_id, notes_key, _notes, video_title):
+    """Build the notes PDF once per version of a video's notes; repeat downloads reuse the bytes"""
+    return generate_pdf(_notes, video_title)
+
+
+def format_notes_preview(partial):
+    """Render the notes fields streamed so far"""
+    preview = ""
+    if 'summary' in partial:
+        preview += f"**Summary:** {partial['summary']}\n\n"
+    if 'key_concepts' in partial:
+        preview += "**Key Concepts:**\n" + "".join(f"- {concept}\n" for concept in partial['key_concepts'])
+    return preview
+
+
+def load_cached_session(video_id, youtube_url, cached_data):
+    """
+    Put a cached session into the app state and go straight to the notes
+    
+    Ends the script run via st.rerun(); callers still return right after it.
+    """
+    st.session_state.video_data = {
+        'video_id': video_id,
+        'url': youtube_url,
+        'transcript': cached_data['transcript'],
+        'notes': cached_data['notes'],
+        'metadata': get_video_metadata(video_id)
+    }
+    st.session_state.quiz_data = {
+        'all_questions': cached_data['questions'],
+        'topic_index': build_topic_index(cached_data['questions']),
+        'current_questions': []
+    }
+    st.session_state.page = 'notes'
+    st.rerun()
 
 
 def show_input_page():
@@ -138,6 +284,12 @@ def show_input_page():
             st.error("Please enter a YouTube URL")
             return
         
+        # Fast path: a cached video needs no transcript fetch, LLM calls or progress UI
+        video_id = extract_video_id(youtube_url)
+        if video_id and storage.session_exists(video_id):
+            load_cached_session(video_id, youtube_url, storage.load_session(video_id))
+            return
+        
         with st.spinner("🔍 Processing video..."):
             progress_bar = st.progress(0)
             status_text = st.empty()
@@ -154,79 +306,61 @@ def show_input_page():
             video_id = transcript_result['video_id']
             transcript = transcript_result['transcript']
             
-            # Check if we have cached data
-            if storage.session_exists(video_id):
-                status_text.text("💾 Loading cached data...")
-                progress_bar.progress(100)
-                cached_data = storage.load_session(video_id)
-                
-                st.session_state.video_data = {
-                    'video_id': video_id,
-                    'url': youtube_url,
-                    'transcript': cached_data['transcript'],
-                    'notes': cached_data['notes'],
-                    'metadata': get_video_metadata(video_id)
-                }
-                st.session_state.quiz_data = {
-                    'all_questions': cached_data['questions'],
-                    'current_questions': []
-                }
-                
-                time.sleep(0.5)
-                st.success("✅ Loaded from cache!")
-                time.sleep(1)
-                st.session_state.page = 'notes'
-                st.rerun()
-                return
+            # Look for a near-duplicate transcript (re-uploads, mirrors)
+            status_text.text("🔎 Checking for similar lectures...")
+            embedding = embed_transcript(transcript)
+            similar_id = find_similar(embedding, storage.load_embedding_index())
+            if similar_id:
+                similar_session = storage.load_session(similar_id)
+                if confirm_match(transcript, similar_session['transcript']):
+                    # Cache the reused session under this ID too, so the next visit takes the fast path
+                    if similar_session['questions']:
+                        storage.save_session(
+                            video_id,
+                            transcript,
+                            similar_session['notes'],
+                            similar_session['questions'],
+                            embedding=embedding
+                        )
+                    load_cached_session(video_id, youtube_url, similar_session)
+                    return
             
-            # Step 2: Generate notes
+            # Step 2: Generate notes (streamed into a live preview)
             status_text.text("📝 Generating structured notes...")
             progress_bar.progress(50)
-            notes_result = generate_notes(transcript, video_id)
+            notes_preview = st.empty()
+            notes_result = generate_notes(
+                transcript,
+                video_id,
+                on_progress=lambda partial: notes_preview.markdown(format_notes_preview(partial))
+            )
+            notes_preview.empty()
             
             if not notes_result['success']:
                 st.error(f"❌ {notes_result['error']}")
                 return
             
-            # Step 3: Generate questions
-            status_text.text("🎯 Creating quiz questions...")
-            progress_bar.progress(75)
-            questions_result = generate_questions(notes_result['notes'], num_questions=50)
-            
-            if not questions_result['success']:
-                st.error(f"❌ {questions_result['error']}")
-                return
-            
-            # Save to cache
-            status_text.text("💾 Saving data...")
-            progress_bar.progress(90)
-            storage.save_session(
-                video_id,
-                transcript,
-                notes_result['notes'],
-                questions_result['questions']
-            )
-            
             # Store in session
             st.session_state.video_data = {
                 'video_id': video_id,
                 'url': youtube_url,
                 'transcript': transcript,
                 'notes': notes_result['notes'],
+                'embedding': embedding,
                 'metadata': get_video_metadata(video_id)
             }
             
             st.session_state.quiz_data = {
-                'all_questions': questions_result['questions'],
+                'all_questions': [],
+                'topic_index': {},
                 'current_questions': []
             }
             
-            progress_bar.progress(100)
-            status_text.text("✅ All done!")
+            # Step 3: Generate questions in the background while the user reads the notes
+            submit_questions_job()
             
-            time.sleep(1)
-            st.success("🎉 Ready! Proceed to view your notes.")
-            time.sleep(1)
+            progress_bar.progress(100)
+            status_text.text("✅ Notes ready!")
             st.session_state.page = 'notes'
             st.rerun()
 
@@ -249,7 +383,11 @@ def show_notes_page():
     st.write("---")
     
     # Display notes
-    formatted_notes = format_notes_for_display(notes)
+    # Formatted once per loaded video; reruns of the notes page reuse the markdown
+    video_data = st.session_state.video_data
+    if 'notes_markdown' not in video_data:
+        video_data['notes_markdown'] = format_notes_for_display(notes)
+    formatted_notes = video_data['notes_markdown']
     st.markdown(formatted_notes)
     
     st.write("---")
@@ -266,7 +404,7 @@ def show_notes_page():
         if st.button("📥 Download Notes as PDF"):
             # Generate PDF
             video_title = metadata.get('title', 'YouTube Lecture Notes')
-            pdf_bytes = generate_pdf(notes, video_title)
+            pdf_bytes = get_notes_pdf(video_data['video_id'], notes_fingerprint(notes), notes, video_title)
             
             st.download_button(
                 label="⬇️ Download PDF",
@@ -278,9 +416,7 @@ def show_notes_page():
     
     with col3:
         if st.button("🔄 New Video"):
-            # Reset session
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            reset_session_state()
             st.rerun()
 
 
@@ -288,6 +424,14 @@ def show_mode_selection():
     """Page 3: Quiz Mode Selection"""
     st.markdown("<h1 class='main-header'>🎮 Select Quiz Mode</h1>", unsafe_allow_html=True)
     
+    # Question generation failed; let the user try again instead of starting an empty quiz
+    questions_error = st.session_state.quiz_data.get('questions_error')
+    if questions_error:
+        st.error(f"❌ {questions_error}")
+        if st.button("🔄 Retry questions"):
+            submit_questions_job()
+            st.rerun()
+    
     st.write("")
     st.markdown("### Choose how many questions you want to answer:")
     st.write("")
@@ -295,46 +439,19 @@ def show_mode_selection():
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.markdown("""
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                    padding: 20px; border-radius: 10px; text-align: center; color: white;
-                    box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);'>
-            <h2 style='margin:0; font-size: 2.5em;'>🎮</h2>
-            <h3 style='margin: 10px 0;'>Quick Play</h3>
-            <p style='margin: 5px 0; font-size: 1.1em;'>5 questions</p>
-            <p style='margin: 5px 0;'>⏱️ ~5 minutes</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(QUICK_PLAY_CARD, unsafe_allow_html=True)
         st.write("")
         if st.button("Start Quick Play", key="quick", use_container_width=True):
             start_quiz(5)
     
     with col2:
-        st.markdown("""
-        <div style='background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); 
-                    padding: 20px; border-radius: 10px; text-align: center; color: white;
-                    box-shadow: 0 4px 12px rgba(240, 147, 251, 0.3);'>
-            <h2 style='margin:0; font-size: 2.5em;'>📚</h2>
-            <h3 style='margin: 10px 0;'>Standard</h3>
-            <p style='margin: 5px 0; font-size: 1.1em;'>15 questions</p>
-            <p style='margin: 5px 0;'>⏱️ ~15 minutes</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(STANDARD_CARD, unsafe_allow_html=True)
         st.write("")
         if st.button("Start Standard", key="standard", type="primary", use_container_width=True):
             start_quiz(15)
     
     with col3:
-        st.markdown("""
-        <div style='background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); 
-                    padding: 20px; border-radius: 10px; text-align: center; color: white;
-                    box-shadow: 0 4px 12px rgba(79, 172, 254, 0.3);'>
-            <h2 style='margin:0; font-size: 2.5em;'>🏆</h2>
-            <h3 style='margin: 10px 0;'>Challenge</h3>
-            <p style='margin: 5px 0; font-size: 1.1em;'>30 questions</p>
-            <p style='margin: 5px 0;'>⏱️ ~30 minutes</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(CHALLENGE_CARD, unsafe_allow_html=True)
         st.write("")
         if st.button("Start Challenge", key="challenge", use_container_width=True):
             start_quiz(30)
@@ -347,10 +464,49 @@ def show_mode_selection():
         st.rerun()
 
 
-def start_quiz(num_questions):
-    """Initialize quiz with selected number of questions"""
-    all_questions = st.session_state.quiz_data['all_questions']
-    selected = select_quiz_questions(all_questions, num_questions)
+def wait_for_questions():
+    """
+    Collect the background question generation started after the notes
+    
+    Returns:
+        bool: True if quiz_data holds a non-empty question pool; otherwise the
+            reason is kept in quiz_data['questions_error']
+    """
+    quiz_data = st.session_state.quiz_data
+    future = st.session_state.get('questions_future')
+    
+    if future is not None:
+        # Usually done already; otherwise wait for the remaining generation
+        with st.spinner("🎯 Finishing your quiz questions..."):
+            questions_result = future.result()
+        del st.session_state['questions_future']
+        
+        if questions_result['success']:
+            quiz_data['all_questions'] = questions_result['questions']
+            quiz_data['topic_index'] = build_topic_index(questions_result['questions'])
+        else:
+            quiz_data['questions_error'] = questions_result['error']
+    
+    if not quiz_data.get('all_questions'):
+        quiz_data.setdefault('questions_error', 'No quiz questions are available for this video.')
+        return False
+    
+    return True
+
+
+def start_quiz(num_questions, topics=None):
+    """Initialize quiz with selected number of questions, optionally limited to some topics"""
+    if not wait_for_questions():
+        # Re-render the mode page with the error and the retry button
+        st.rerun()
+    
+    quiz_data = st.session_state.quiz_data
+    selected = select_quiz_questions(
+        quiz_data['all_questions'],
+        num_questions,
+        topics=topics,
+        topic_index=quiz_data.get('topic_index')
+    )
     
     st.session_state.quiz_data['current_questions'] = selected
     st.session_state.current_question = 0
@@ -480,30 +636,33 @@ def show_results_page():
     else:
         st.warning("📚 Keep studying! Focus on the topics that need improvement.")
     
-    st.write("---")
-    
-    # Topic performance
-    st.markdown("### 📊 Performance by Topic")
+    # Topic performance (built into one markdown block: one frontend update)
     topic_performance = calculate_topic_performance(answers)
     
+    report = io.StringIO()
+    report.write("---\n\n### 📊 Performance by Topic\n\n")
     for topic, stats in topic_performance.items():
         emoji = "✅" if stats['percentage'] >= 80 else "⚠️" if stats['percentage'] >= 60 else "❌"
-        st.markdown(f"{emoji} **{topic}**: {stats['correct']}/{stats['total']} ({stats['percentage']:.0f}%) - {stats['status']}")
+        report.write(f"{emoji} **{topic}**: {stats['correct']}/{stats['total']} ({stats['percentage']:.0f}%) - {stats['status']}\n\n")
+    st.markdown(report.getvalue())
     
     # Weak topics
     weak_topics = get_weak_topics(topic_performance, threshold=60)
     
     if weak_topics:
-        st.write("")
-        st.write("---")
-        st.markdown("### 🎯 Topics to Review")
+        st.markdown("---\n\n### 🎯 Topics to Review")
         
+        video_url = st.session_state.video_data['metadata']['url']
+        review = io.StringIO()
         for topic_info in weak_topics:
-            st.warning(f"**{topic_info['topic']}**: {topic_info['score']} ({topic_info['percentage']:.0f}%)")
-            st.markdown(f"📺 [Re-watch this topic]({st.session_state.video_data['metadata']['url']})")
+            review.write(f"**{topic_info['topic']}**: {topic_info['score']} ({topic_info['percentage']:.0f}%)  \n")
+            review.write(f"📺 [Re-watch this topic]({video_url})\n\n")
+        st.warning(review.getvalue())
+        
+        if st.button("🎯 Practice Weak Topics"):
+            start_quiz(15, topics=[topic_info['topic'] for topic_info in weak_topics])
     
-    st.write("")
-    st.write("---")
+    st.markdown("---")
     
     # Action buttons
     col1, col2, col3 = st.columns(3)
@@ -524,13 +683,14 @@ def show_results_page():
     
     with col3:
         if st.button("🆕 New Video"):
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            reset_session_state()
             st.rerun()
 
 
 # Main app routing
 def main():
+    st.markdown(APP_CSS, unsafe_allow_html=True)
+    
     page = st.session_state.page
     
     if page == 'input':
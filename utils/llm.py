@@ -4,51 +4,274 @@ Handles all LLM API calls for notes generation and question creation
 """
 
 import os
-import json
 import time
+import orjson
+import re
+import random
+import asyncio
+import logging
+import threading
+import functools
+import contextlib
+import types
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from litellm import completion
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Model fallback chain
 MODEL_CHAIN = [
     "gemini/gemini-2.5-flash-lite",
     "gemini/gemini-2.0-flash",
 ]
 
-def call_llm_with_retry(messages, temperature=0.3, max_tokens=4000, max_retries=3):
-    """Call LLM with retry logic and model fallback"""
+# Input budget of the primary model; transcripts over half of it are map-reduced
+MAX_INPUT_TOKENS = 900_000
+
+# Transcript window size for map-reduce summarization of very long lectures
+CHUNK_TOKENS = 30_000
+
+# Cap on simultaneous requests to the provider (Gemini QPM limits)
+MAX_CONCURRENT_REQUESTS = 8
+
+# Longest backoff between retries, in seconds (before jitter)
+MAX_BACKOFF = 30
+
+# HTTP timeout for a single LLM request, in seconds
+REQUEST_TIMEOUT = 60.0
+
+# Max pooled connections kept alive to the provider
+MAX_CONNECTIONS = 16
+
+# Process-wide cap on in-flight provider requests, shared by all Streamlit
+# sessions and background jobs: sync, batch, streamed and async calls all
+# hold a slot for as long as their request is open
+_REQUEST_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# JSON schema the notes response must follow (Gemini structured output)
+NOTES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "key_concepts": {"type": "array", "items": {"type": "string"}},
+        "topics": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "keywords": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["name", "description", "keywords"]
+            }
+        },
+        "detailed_notes": {"type": "string"}
+    },
+    "required": ["summary", "key_concepts", "topics", "detailed_notes"]
+}
+
+# Schema for the reduce step of map-reduce notes (detailed notes are concatenated locally)
+MERGED_NOTES_SCHEMA = {
+    "type": "object",
+    "properties": {key: NOTES_SCHEMA["properties"][key] for key in ("summary", "key_concepts", "topics")},
+    "required": ["summary", "key_concepts", "topics"]
+}
+
+@functools.lru_cache(maxsize=1)
+def _litellm():
+    """
+    Import litellm on first use
+    
+    litellm is slow to import, and sessions served from the cache never call
+    the LLM, so the import is deferred until the first request needs it.
+    """
+    import litellm
+    from litellm.llms.custom_httpx.http_handler import HTTPHandler, AsyncHTTPHandler
+    
+    return types.SimpleNamespace(
+        completion=litellm.completion,
+        acompletion=litellm.acompletion,
+        stream_chunk_builder=litellm.stream_chunk_builder,
+        token_counter=litellm.token_counter,
+        encode=litellm.encode,
+        decode=litellm.decode,
+        AsyncHTTPHandler=AsyncHTTPHandler,
+        # One sync client for the whole process, so every call reuses warm connections
+        http_client=HTTPHandler(timeout=REQUEST_TIMEOUT, concurrent_limit=MAX_CONNECTIONS)
+    )
+
+
+# Completed JSON values that can be previewed while the notes are still streaming
+_PARTIAL_SUMMARY = re.compile(r'"summary"\s*:\s*("(?:[^"\\]|\\.)*")')
+_PARTIAL_CONCEPTS = re.compile(r'"key_concepts"\s*:\s*(\[(?:[^\]"]|"(?:[^"\\]|\\.)*")*\])')
+
+def _classify_error(error_str):
+    """Decide how the retry ladder should react to an LLM error"""
+    if "503" in error_str or "overloaded" in error_str.lower() or "429" in error_str:
+        return 'busy'
+    if "404" in error_str or "not found" in error_str.lower():
+        return 'unavailable'
+    return 'other'
+
+
+def _retry_after_seconds(error):
+    """Read the provider's Retry-After hint (in seconds) from an LLM error, if any"""
+    headers = getattr(error, 'litellm_response_headers', None)
+    if headers is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt, error=None):
+    """
+    Jittered exponential backoff for a retry
+    
+    Jitter keeps clients that were throttled together from retrying in
+    lockstep; a Retry-After hint from the provider is used as a floor.
+    """
+    wait_time = min(MAX_BACKOFF, (2 ** attempt) * 2) * (0.5 + random.random())
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        # Clamped, so a huge header can't block a Streamlit thread indefinitely
+        wait_time = max(wait_time, min(retry_after, MAX_BACKOFF))
+    return wait_time
+
+
+def _provider_kwargs(model, client, response_format):
+    """
+    Gemini-only call options, adapted for other providers
+    
+    The shared litellm HTTP handlers and the response_schema form of JSON
+    mode are Gemini-specific; other providers use their own clients and get
+    plain JSON mode.
+    """
+    if model.startswith("gemini/"):
+        return {'client': client, 'response_format': response_format}
+    
+    if response_format is not None:
+        response_format = {key: value for key, value in response_format.items() if key != 'response_schema'}
+    return {'response_format': response_format}
+
+
+class _SlotStream:
+    """
+    Streamed response that holds a request slot until it's exhausted, closed or collected
+    
+    Unlike a generator's finally block, close() and __del__ release the slot
+    even if the caller never starts iterating.
+    """
+    
+    def __init__(self, stream):
+        self._stream = iter(stream)
+        self._held = True
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        try:
+            return next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+    
+    def close(self):
+        """Release the request slot (idempotent)"""
+        if self._held:
+            self._held = False
+            _REQUEST_SLOTS.release()
+    
+    __del__ = close
+
+
+@functools.lru_cache(maxsize=1)
+def _get_batch_executor():
+    """Thread pool shared by every call_llm_batch call, created on first use"""
+    return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix="llm-batch")
+
+
+def _completion_in_slot(llm, **kwargs):
+    """Run one blocking completion under a request slot, returning the exception instead of raising"""
+    try:
+        with _REQUEST_SLOTS:
+            return llm.completion(**kwargs)
+    except Exception as e:
+        return e
+
+
+async def _aacquire_slot():
+    """Wait for a process-wide request slot in a worker thread, without blocking the event loop"""
+    acquire = asyncio.ensure_future(asyncio.to_thread(_REQUEST_SLOTS.acquire))
+    try:
+        await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        # The thread can't be interrupted; hand back the slot once it gets one
+        acquire.add_done_callback(lambda future: future.cancelled() or _REQUEST_SLOTS.release())
+        raise
+
+
+def call_llm_with_retry(messages, temperature=0.3, max_tokens=4000, max_retries=3, stream=False, response_format=None):
+    """
+    Call LLM with retry logic and model fallback
+    
+    With stream=True the returned response is an iterator of chunks that holds
+    its request slot until it is read to the end or closed; retries only
+    cover opening the stream, not errors raised mid-stream.
+    response_format is passed through to litellm (e.g. Gemini JSON mode); see
+    _provider_kwargs() for how it's adapted to non-Gemini models.
+    """
+    
+    llm = _litellm()
     
     for model in MODEL_CHAIN:
         for attempt in range(max_retries):
             try:
-                response = completion(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
+                _REQUEST_SLOTS.acquire()
+                try:
+                    response = llm.completion(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=stream,
+                        **_provider_kwargs(model, llm.http_client, response_format)
+                    )
+                except Exception:
+                    _REQUEST_SLOTS.release()
+                    raise
+                
+                if stream:
+                    return _SlotStream(response)
+                _REQUEST_SLOTS.release()
                 return response
             
             except Exception as e:
-                error_str = str(e)
+                error_kind = _classify_error(str(e))
                 
                 # If overloaded or rate limited, wait and retry
-                if "503" in error_str or "overloaded" in error_str.lower() or "429" in error_str:
+                if error_kind == 'busy':
                     if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) * 2  # Exponential backoff: 2s, 4s, 8s
-                        print(f"Model {model} busy, retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})")
+                        wait_time = _backoff_delay(attempt, e)  # Jittered exponential backoff: ~2s, 4s, 8s
+                        logger.warning("Model %s busy, retrying in %.1fs... (attempt %s/%s)", model, wait_time, attempt + 1, max_retries)
                         time.sleep(wait_time)
                         continue
                     else:
-                        print(f"Model {model} failed after {max_retries} attempts, trying next model...")
+                        logger.warning("Model %s failed after %s attempts, trying next model...", model, max_retries)
                         break
                 
                 # If 404 or model not found, try next model immediately
-                elif "404" in error_str or "not found" in error_str.lower():
-                    print(f"Model {model} not available, trying next model...")
+                elif error_kind == 'unavailable':
+                    logger.warning("Model %s not available, trying next model...", model)
                     break
                 
                 # For other errors, raise immediately
@@ -61,36 +284,162 @@ def call_llm_with_retry(messages, temperature=0.3, max_tokens=4000, max_retries=
     raise Exception("All models failed. Please check your API keys or try again later.")
 
 
-def generate_notes(transcript, video_id=None):
+def call_llm_batch(message_lists, temperature=0.3, max_tokens=4000, max_retries=3, response_format=None):
     """
-    Generate structured lecture notes from transcript using LLM
+    Send several prompts concurrently with retry and model fallback
+    
+    Works like litellm.batch_completion, but on a shared thread pool where
+    each prompt takes a process-wide request slot (batch_completion has no
+    hook for that). All prompts share one client and connection pool instead
+    of paying the connection setup per call. Only the prompts that failed are
+    retried or passed on to the next model.
     
     Args:
-        transcript (str): Full video transcript text
-        video_id (str, optional): YouTube video ID for timestamp links
+        message_lists (list): One messages list per prompt
+        response_format (dict): Passed through to litellm for every prompt (e.g. Gemini JSON mode),
+            adapted per provider by _provider_kwargs()
         
     Returns:
-        dict: {
-            'success': bool,
-            'notes': {
-                'summary': str,
-                'key_concepts': list[str],
-                'topics': list[dict],  # [{'name': str, 'timestamp': str, 'description': str}]
-                'detailed_notes': str
-            },
-            'error': str (if failed)
-        }
+        list: A response per prompt, in order, or the exception if that prompt
+            failed on every model
     """
-    try:
-        # Check if transcript is too short
-        if len(transcript) < 100:
-            return {
-                'success': False,
-                'error': 'Transcript is too short to generate meaningful notes.'
-            }
-        
-        # Create prompt for structured notes generation
-        prompt = f"""You are an expert educational content creator. Analyze this lecture transcript and create comprehensive, structured notes.
+    llm = _litellm()
+    pool = _get_batch_executor()
+    responses = [None] * len(message_lists)
+    pending = list(range(len(message_lists)))
+    
+    for model in MODEL_CHAIN:
+        for attempt in range(max_retries):
+            results = list(pool.map(
+                lambda messages: _completion_in_slot(
+                    llm,
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **_provider_kwargs(model, llm.http_client, response_format)
+                ),
+                [message_lists[i] for i in pending]
+            ))
+            
+            failed = []
+            for index, result in zip(pending, results):
+                responses[index] = result
+                if isinstance(result, Exception):
+                    failed.append(index)
+            
+            pending = failed
+            if not pending:
+                return responses
+            
+            error_kinds = {_classify_error(str(responses[i])) for i in pending}
+            
+            # If the model itself is missing, move on immediately
+            if error_kinds == {'unavailable'}:
+                logger.warning("Model %s not available, trying next model...", model)
+                break
+            
+            if attempt < max_retries - 1:
+                if 'busy' in error_kinds:
+                    wait_time = max(_backoff_delay(attempt, responses[i]) for i in pending)
+                else:
+                    wait_time = 2
+                logger.warning("%s request(s) to %s failed, retrying in %.1fs... (attempt %s/%s)", len(pending), model, wait_time, attempt + 1, max_retries)
+                time.sleep(wait_time)
+            else:
+                logger.warning("Model %s failed after %s attempts, trying next model...", model, max_retries)
+    
+    return responses
+
+
+def create_async_client():
+    """
+    Create an async HTTP client to share across the LLM calls of one event loop
+    
+    Async connection pools are bound to the loop that created them, so each
+    asyncio.run() pipeline opens one client, passes it to every
+    acall_llm_with_retry() call, and closes it when done.
+    """
+    return _litellm().AsyncHTTPHandler(timeout=REQUEST_TIMEOUT, concurrent_limit=MAX_CONNECTIONS)
+
+
+async def acall_llm_with_retry(messages, temperature=0.3, max_tokens=4000, max_retries=3, semaphore=None, client=None, response_format=None):
+    """
+    Async variant of call_llm_with_retry for running several LLM calls concurrently
+    
+    Uses the same retry/fallback ladder, but awaits litellm.acompletion and
+    asyncio.sleep so other in-flight calls keep making progress while one backs off.
+    Every request also takes a process-wide slot, shared with the sync calls.
+    An optional asyncio.Semaphore further caps this pipeline's requests, and
+    an optional client from create_async_client() reuses one connection pool.
+    """
+    semaphore = semaphore or contextlib.nullcontext()
+    llm = _litellm()
+    
+    for model in MODEL_CHAIN:
+        for attempt in range(max_retries):
+            try:
+                async with semaphore:
+                    await _aacquire_slot()
+                    try:
+                        response = await llm.acompletion(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            **_provider_kwargs(model, client, response_format)
+                        )
+                    finally:
+                        _REQUEST_SLOTS.release()
+                return response
+            
+            except Exception as e:
+                error_kind = _classify_error(str(e))
+                
+                if error_kind == 'busy':
+                    if attempt < max_retries - 1:
+                        wait_time = _backoff_delay(attempt, e)
+                        logger.warning("Model %s busy, retrying in %.1fs... (attempt %s/%s)", model, wait_time, attempt + 1, max_retries)
+                        await asyncio.sleep(wait_time)
+                        continue
+                    else:
+                        logger.warning("Model %s failed after %s attempts, trying next model...", model, max_retries)
+                        break
+                
+                elif error_kind == 'unavailable':
+                    logger.warning("Model %s not available, trying next model...", model)
+                    break
+                
+                else:
+                    if attempt == max_retries - 1:
+                        raise
+                    await asyncio.sleep(2)
+                    continue
+    
+    raise Exception("All models failed. Please check your API keys or try again later.")
+
+
+def _parse_partial_notes(buffer):
+    """
+    Pull the fields that are already complete out of a partially streamed notes JSON
+    
+    Returns:
+        dict: Any of 'summary' and 'key_concepts' whose values have closed
+    """
+    partial = {}
+    for key, pattern in (('summary', _PARTIAL_SUMMARY), ('key_concepts', _PARTIAL_CONCEPTS)):
+        match = pattern.search(buffer)
+        if match:
+            try:
+                partial[key] = orjson.loads(match.group(1))
+            except orjson.JSONDecodeError:
+                pass
+    return partial
+
+
+def _build_notes_prompt(transcript):
+    """Create prompt for structured notes generation"""
+    return f"""You are an expert educational content creator. Analyze this lecture transcript and create comprehensive, structured notes.
 
 TRANSCRIPT:
 {transcript}
@@ -119,32 +468,86 @@ Requirements:
    - Bullet points for key information
    - Important formulas, definitions, or code snippets if applicable
 
-IMPORTANT: Return ONLY valid JSON, no additional text before or after."""
+IMPORTANT: Return ONLY valid JSON."""
+
+
+def generate_notes(transcript, video_id=None, on_progress=None):
+    """
+    Generate structured lecture notes from transcript using LLM
+    
+    Args:
+        transcript (str): Full video transcript text
+        video_id (str, optional): YouTube video ID for timestamp links
+        on_progress (callable, optional): Enables streaming; called with a dict of
+            the notes fields completed so far ('summary', 'key_concepts') as they arrive
+        
+    Returns:
+        dict: {
+            'success': bool,
+            'notes': {
+                'summary': str,
+                'key_concepts': list[str],
+                'topics': list[dict],  # [{'name': str, 'timestamp': str, 'description': str}]
+                'detailed_notes': str
+            },
+            'error': str (if failed)
+        }
+    """
+    try:
+        # Check if transcript is too short
+        if len(transcript) < 100:
+            return {
+                'success': False,
+                'error': 'Transcript is too short to generate meaningful notes.'
+            }
+        
+        # Long lectures: summarize windows in parallel, then merge
+        # (text has at least as many characters as tokens, so short transcripts skip counting)
+        if len(transcript) > MAX_INPUT_TOKENS // 2:
+            total_tokens = _litellm().token_counter(model=MODEL_CHAIN[0], text=transcript)
+            if total_tokens > MAX_INPUT_TOKENS // 2:
+                notes_data, token_usage = asyncio.run(_agenerate_notes_map_reduce(transcript, total_tokens))
+                return {
+                    'success': True,
+                    'notes': notes_data,
+                    'token_usage': token_usage
+                }
+        
+        # Create prompt for structured notes generation
+        prompt = _build_notes_prompt(transcript)
 
         # Call LLM with retry and fallback
+        messages = [{"role": "user", "content": prompt}]
         response = call_llm_with_retry(
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
             temperature=0.3,
-            max_tokens=4000
+            max_tokens=4000,
+            stream=on_progress is not None,
+            response_format={"type": "json_object", "response_schema": NOTES_SCHEMA}
         )
         
+        if on_progress is not None:
+            # Surface fields as soon as they close, then rebuild a regular response
+            chunks = []
+            buffer = ""
+            shown = {}
+            for chunk in response:
+                chunks.append(chunk)
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                buffer += delta
+                partial = _parse_partial_notes(buffer)
+                if partial != shown:
+                    shown = partial
+                    on_progress(partial)
+            response = _litellm().stream_chunk_builder(chunks, messages=messages)
+        
         # Extract response
+        # JSON mode guarantees raw JSON, so there are no code fences to strip
         content = response.choices[0].message.content
         
-        # Try to parse JSON from response
-        # Sometimes LLMs wrap JSON in markdown code blocks
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
-        # Parse JSON
-        notes_data = json.loads(content)
-        
-        # Validate structure
-        required_keys = ['summary', 'key_concepts', 'topics', 'detailed_notes']
-        if not all(key in notes_data for key in required_keys):
-            raise ValueError("LLM response missing required fields")
+        notes_data = _parse_notes(content)
         
         return {
             'success': True,
@@ -156,7 +559,7 @@ IMPORTANT: Return ONLY valid JSON, no additional text before or after."""
             }
         }
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         return {
             'success': False,
             'error': f'Failed to parse LLM response as JSON: {str(e)}',
@@ -170,6 +573,158 @@ IMPORTANT: Return ONLY valid JSON, no additional text before or after."""
         }
 
 
+def _parse_notes(content, required_keys=('summary', 'key_concepts', 'topics', 'detailed_notes')):
+    """Parse and validate a notes JSON response"""
+    # Parse JSON
+    notes_data = orjson.loads(content)
+    
+    # Validate structure
+    if not all(key in notes_data for key in required_keys):
+        raise ValueError("LLM response missing required fields")
+    
+    return notes_data
+
+
+def truncate_to_tokens(text, max_tokens, model=MODEL_CHAIN[0]):
+    """
+    Cut text to at most max_tokens tokens, ending on a word boundary
+    
+    Args:
+        text (str): Text to truncate
+        max_tokens (int): Token budget
+        model (str): Model whose tokenizer litellm should use
+        
+    Returns:
+        str: The text unchanged if it fits, otherwise its longest prefix within budget
+    """
+    # Text has at least as many characters as tokens, so short text never needs encoding
+    if len(text) <= max_tokens:
+        return text
+    
+    llm = _litellm()
+    tokens = llm.encode(model=model, text=text)
+    if len(tokens) <= max_tokens:
+        return text
+    
+    # Drop the last, possibly split, word
+    return llm.decode(model=model, tokens=tokens[:max_tokens]).rsplit(None, 1)[0]
+
+
+def _split_transcript(transcript, total_tokens):
+    """Split a transcript on word boundaries into windows of about CHUNK_TOKENS tokens"""
+    words = transcript.split()
+    num_windows = -(-total_tokens // CHUNK_TOKENS)
+    window_size = -(-len(words) // num_windows)
+    return [' '.join(words[i:i + window_size]) for i in range(0, len(words), window_size)]
+
+
+async def _agenerate_notes_map_reduce(transcript, total_tokens):
+    """
+    Generate notes for a transcript too long for a single prompt
+    
+    Map: notes for each ~CHUNK_TOKENS window, generated concurrently.
+    Reduce: one call merges the per-window summaries, concepts and topics;
+    the detailed notes of the windows are concatenated in order.
+    
+    Returns:
+        tuple: (notes dict, token usage dict)
+    """
+    windows = _split_transcript(transcript, total_tokens)
+    response_format = {"type": "json_object", "response_schema": NOTES_SCHEMA}
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    client = create_async_client()
+    
+    try:
+        responses = await asyncio.gather(*[
+            acall_llm_with_retry(
+                messages=[{"role": "user", "content": _build_notes_prompt(window)}],
+                temperature=0.3,
+                max_tokens=4000,
+                semaphore=semaphore,
+                client=client,
+                response_format=response_format
+            )
+            for window in windows
+        ])
+        window_notes = [_parse_notes(response.choices[0].message.content) for response in responses]
+        
+        # Deduplicate across windows before asking the model to merge
+        seen = set()
+        concepts = []
+        for notes in window_notes:
+            for concept in notes['key_concepts']:
+                if concept.lower() not in seen:
+                    seen.add(concept.lower())
+                    concepts.append(concept)
+        
+        seen = set()
+        topics_text = ""
+        for notes in window_notes:
+            for topic in notes['topics']:
+                if topic['name'].lower() not in seen:
+                    seen.add(topic['name'].lower())
+                    topics_text += f"- {topic['name']}: {topic['description']}\n"
+        
+        summaries_text = "\n".join(
+            f"Part {i}: {notes['summary']}" for i, notes in enumerate(window_notes, 1)
+        )
+        
+        prompt = f"""You are an expert educational content creator. These notes were written for consecutive parts of one long lecture. Merge them into notes for the whole lecture.
+
+PART SUMMARIES:
+{summaries_text}
+
+KEY CONCEPTS:
+{', '.join(concepts)}
+
+TOPICS:
+{topics_text}
+Please provide your response in the following JSON format (ensure valid JSON):
+{{
+    "summary": "A 3-4 sentence overview of the entire lecture",
+    "key_concepts": ["concept 1", "concept 2", "concept 3", ...],
+    "topics": [
+        {{
+            "name": "Topic Name",
+            "description": "Brief description of this topic",
+            "keywords": ["keyword1", "keyword2"]
+        }}
+    ]
+}}
+
+Requirements:
+1. Summary: Capture the main purpose and key takeaways of the whole lecture
+2. Key Concepts: The 5-10 most important concepts from the list above
+3. Topics: Merge overlapping topics into 5-8 major topics (these will be used for quiz categorization)
+
+IMPORTANT: Return ONLY valid JSON."""
+
+        reduce_response = await acall_llm_with_retry(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=2000,
+            client=client,
+            response_format={"type": "json_object", "response_schema": MERGED_NOTES_SCHEMA}
+        )
+    finally:
+        await client.close()
+    
+    notes_data = _parse_notes(
+        reduce_response.choices[0].message.content,
+        required_keys=('summary', 'key_concepts', 'topics')
+    )
+    notes_data['detailed_notes'] = "\n\n".join(notes['detailed_notes'] for notes in window_notes)
+    
+    all_responses = responses + [reduce_response]
+    token_usage = {
+        'input': sum(response.usage.prompt_tokens for response in all_responses),
+        'output': sum(response.usage.completion_tokens for response in all_responses),
+        'total': sum(response.usage.total_tokens for response in all_responses)
+    }
+    
+    return notes_data, token_usage
+
+
 def format_notes_for_display(notes_data):
     """
     Format notes data into readable markdown for display
@@ -180,28 +735,24 @@ def format_notes_for_display(notes_data):
     Returns:
         str: Formatted markdown text
     """
-    markdown = f"""# Lecture Notes
-
-## Summary
-{notes_data['summary']}
-
-## Key Concepts
-"""
-    
-    for concept in notes_data['key_concepts']:
-        markdown += f"- {concept}\n"
+    parts = [
+        "# Lecture Notes\n\n## Summary\n",
+        notes_data['summary'],
+        "\n\n## Key Concepts\n"
+    ]
+    parts.extend(f"- {concept}\n" for concept in notes_data['key_concepts'])
     
-    markdown += "\n## Topics Covered\n"
+    parts.append("\n## Topics Covered\n")
     
     for i, topic in enumerate(notes_data['topics'], 1):
-        markdown += f"\n### {i}. {topic['name']}\n"
-        markdown += f"{topic['description']}\n"
+        parts.append(f"\n### {i}. {topic['name']}\n")
+        parts.append(f"{topic['description']}\n")
         if 'keywords' in topic:
-            markdown += f"**Keywords:** {', '.join(topic['keywords'])}\n"
+            parts.append(f"**Keywords:** {', '.join(topic['keywords'])}\n")
     
-    markdown += f"\n---\n\n## Detailed Notes\n\n{notes_data['detailed_notes']}\n"
+    parts.append(f"\n---\n\n## Detailed Notes\n\n{notes_data['detailed_notes']}\n")
     
-    return markdown
+    return "".join(parts)
 
 
 # Test function
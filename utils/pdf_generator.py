@@ -3,14 +3,119 @@ PDF Generation Module
 Converts notes to well-formatted PDF documents
 """
 
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER
-from reportlab.lib.colors import HexColor
+import functools
 import io
+import os
 import re
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads for generate_pdfs_batch
+MAX_PDF_WORKERS = min(8, os.cpu_count() or 1)
+
+# Largest merged body block (escaped characters); a Paragraph that spans pages
+# is re-wrapped on every page it splits across, so blocks stay under about a page
+MAX_BLOCK_CHARS = 3000
+
+# Detailed notes are split before numbered items and markdown headers
+_SECTION_SPLIT = re.compile(r'\n(?=\d+\.|#{1,3}\s)')
+
+# Special XML characters for reportlab, escaped in a single pass
+_XML_ESCAPE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&apos;'
+})
+
+# Same escaping, plus newlines turned into reportlab line breaks
+_XML_ESCAPE_BR = {**_XML_ESCAPE, ord('\n'): '<br/>'}
+
+
+@functools.lru_cache(maxsize=1)
+def _rl():
+    """Import ReportLab on first use, so sessions that never export a PDF don't load it"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak
+    from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
+    from reportlab.lib.colors import HexColor
+    from reportlab import rl_config
+    
+    # Skip ReportLab's per-attribute validation of graphics shapes
+    rl_config.shapeChecking = 0
+    
+    return types.SimpleNamespace(
+        letter=letter,
+        getSampleStyleSheet=getSampleStyleSheet,
+        ParagraphStyle=ParagraphStyle,
+        SimpleDocTemplate=SimpleDocTemplate,
+        Paragraph=Paragraph,
+        PageBreak=PageBreak,
+        TA_JUSTIFY=TA_JUSTIFY,
+        TA_CENTER=TA_CENTER,
+        HexColor=HexColor
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _get_styles():
+    """
+    Build the sample stylesheet and custom paragraph styles once, on first use
+    
+    Gaps between blocks come from spaceBefore/spaceAfter, not Spacer flowables.
+    """
+    rl = _rl()
+    ParagraphStyle = rl.ParagraphStyle
+    HexColor = rl.HexColor
+    styles = rl.getSampleStyleSheet()
+    
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=HexColor('#1f77b4'),
+            spaceAfter=48,
+            alignment=rl.TA_CENTER,
+            fontName='Helvetica-Bold'
+        ),
+        'heading': ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=16,
+            textColor=HexColor('#2c3e50'),
+            spaceAfter=12,
+            spaceBefore=20,
+            fontName='Helvetica-Bold'
+        ),
+        'subheading': ParagraphStyle(
+            'CustomSubHeading',
+            parent=styles['Heading3'],
+            fontSize=14,
+            textColor=HexColor('#34495e'),
+            spaceAfter=10,
+            spaceBefore=10,
+            fontName='Helvetica-Bold'
+        ),
+        'body': ParagraphStyle(
+            'CustomBody',
+            parent=styles['BodyText'],
+            fontSize=11,
+            alignment=rl.TA_JUSTIFY,
+            spaceAfter=12,
+            leading=16
+        ),
+        'bullet': ParagraphStyle(
+            'CustomBullet',
+            parent=styles['BodyText'],
+            fontSize=11,
+            leftIndent=20,
+            spaceAfter=6,
+            leading=14
+        ),
+    }
 
 
 def generate_pdf(notes_data, video_title="YouTube Lecture Notes"):
@@ -24,13 +129,51 @@ def generate_pdf(notes_data, video_title="YouTube Lecture Notes"):
     Returns:
         bytes: PDF file as bytes
     """
-    # Create a BytesIO buffer
     buffer = io.BytesIO()
+    generate_pdf_to_stream(notes_data, buffer, video_title)
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_executor():
+    """Thread pool shared by every generate_pdfs_batch call, created on first use"""
+    return ThreadPoolExecutor(max_workers=MAX_PDF_WORKERS, thread_name_prefix="pdf")
+
+
+def generate_pdfs_batch(jobs):
+    """
+    Generate several PDFs concurrently
+    
+    ReportLab drops the GIL while zlib compresses page streams, so builds on
+    a thread pool overlap instead of running strictly one after another.
+    
+    Args:
+        jobs: List of (notes_data, video_title) tuples
+        
+    Returns:
+        list: PDF bytes per job, in the same order
+    """
+    return list(_get_executor().map(lambda job: generate_pdf(*job), jobs))
+
+
+def generate_pdf_to_stream(notes_data, out_stream, video_title="YouTube Lecture Notes"):
+    """
+    Generate a PDF from notes data straight into a file or writable stream
+    
+    Avoids holding an extra in-memory copy of the document when the caller
+    already has a destination (an open file, a temp file, a response stream).
+    
+    Args:
+        notes_data: Dictionary containing notes structure
+        out_stream: Filename or binary file-like object to write the PDF to
+        video_title: Title of the video
+    """
+    rl = _rl()
     
     # Create the PDF document
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=letter,
+    doc = rl.SimpleDocTemplate(
+        out_stream,
+        pagesize=rl.letter,
         rightMargin=72,
         leftMargin=72,
         topMargin=72,
@@ -40,152 +183,96 @@ def generate_pdf(notes_data, video_title="YouTube Lecture Notes"):
     # Container for the 'Flowable' objects
     elements = []
     
-    # Define styles
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=HexColor('#1f77b4'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=HexColor('#2c3e50'),
-        spaceAfter=12,
-        spaceBefore=12,
-        fontName='Helvetica-Bold'
-    )
-    
-    subheading_style = ParagraphStyle(
-        'CustomSubHeading',
-        parent=styles['Heading3'],
-        fontSize=14,
-        textColor=HexColor('#34495e'),
-        spaceAfter=10,
-        spaceBefore=10,
-        fontName='Helvetica-Bold'
-    )
-    
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['BodyText'],
-        fontSize=11,
-        alignment=TA_JUSTIFY,
-        spaceAfter=12,
-        leading=16
-    )
+    # Hoist hot lookups out of the bullet and section loops
+    _append = elements.append
+    _Paragraph = rl.Paragraph
+    _escape = escape_xml
     
-    bullet_style = ParagraphStyle(
-        'CustomBullet',
-        parent=styles['BodyText'],
-        fontSize=11,
-        leftIndent=20,
-        spaceAfter=6,
-        leading=14
-    )
+    # Shared styles (built once per process)
+    styles = _get_styles()
+    title_style = styles['title']
+    heading_style = styles['heading']
+    subheading_style = styles['subheading']
+    body_style = styles['body']
+    bullet_style = styles['bullet']
     
     # Add title
-    elements.append(Paragraph(video_title, title_style))
-    elements.append(Spacer(1, 0.3 * inch))
+    _append(_Paragraph(_escape(video_title), title_style))
     
     # Add summary
     if 'summary' in notes_data:
-        elements.append(Paragraph("Summary", heading_style))
-        summary_text = notes_data['summary'].replace('\n', '<br/>')
-        elements.append(Paragraph(summary_text, body_style))
-        elements.append(Spacer(1, 0.2 * inch))
+        _append(_Paragraph("Summary", heading_style))
+        _append(_Paragraph(_escape(notes_data['summary'], line_breaks=True), body_style))
     
     # Add key concepts
     if 'key_concepts' in notes_data and notes_data['key_concepts']:
-        elements.append(Paragraph("Key Concepts", heading_style))
+        _append(_Paragraph("Key Concepts", heading_style))
         for concept in notes_data['key_concepts']:
-            # Escape special characters and format
-            concept_clean = escape_xml(concept)
-            bullet_text = f"• {concept_clean}"
-            elements.append(Paragraph(bullet_text, bullet_style))
-        elements.append(Spacer(1, 0.2 * inch))
+            _append(_Paragraph(f"• {_escape(concept)}", bullet_style))
     
     # Add topics covered
     if 'topics_covered' in notes_data and notes_data['topics_covered']:
-        elements.append(Paragraph("Topics Covered", heading_style))
+        _append(_Paragraph("Topics Covered", heading_style))
         for topic in notes_data['topics_covered']:
-            topic_clean = escape_xml(topic)
-            bullet_text = f"• {topic_clean}"
-            elements.append(Paragraph(bullet_text, bullet_style))
-        elements.append(Spacer(1, 0.2 * inch))
+            _append(_Paragraph(f"• {_escape(topic)}", bullet_style))
     
     # Add detailed notes
     if 'detailed_notes' in notes_data:
-        elements.append(PageBreak())
-        elements.append(Paragraph("Detailed Notes", heading_style))
-        elements.append(Spacer(1, 0.1 * inch))
-        
-        # Process detailed notes
-        detailed_text = notes_data['detailed_notes']
+        _append(rl.PageBreak())
+        _append(_Paragraph("Detailed Notes", heading_style))
         
         # Split by sections (looking for numbered sections or headers)
-        sections = re.split(r'\n(?=\d+\.|#{1,3}\s)', detailed_text)
+        sections = _SECTION_SPLIT.split(notes_data['detailed_notes'])
+        
+        # Consecutive body sections share one Paragraph, up to MAX_BLOCK_CHARS;
+        # headers always start a new block
+        body_parts = []
+        body_chars = 0
         
         for section in sections:
             if not section.strip():
                 continue
                 
-            # Check if it's a header (starts with # or numbered)
+            # Check if it's a header (starts with #)
             lines = section.split('\n')
             first_line = lines[0].strip()
             
             # Format headers
             if first_line.startswith('#'):
+                if body_parts:
+                    _append(_Paragraph('<br/><br/>'.join(body_parts), body_style))
+                    body_parts = []
+                    body_chars = 0
+                
                 # Remove # symbols
-                header_text = first_line.lstrip('#').strip()
-                header_clean = escape_xml(header_text)
-                elements.append(Paragraph(header_clean, subheading_style))
-                # Process remaining lines
+                _append(_Paragraph(_escape(first_line.lstrip('#').strip()), subheading_style))
+                # Remaining lines open the next body block
                 remaining = '\n'.join(lines[1:]).strip()
                 if remaining:
-                    remaining_clean = escape_xml(remaining).replace('\n', '<br/>')
-                    elements.append(Paragraph(remaining_clean, body_style))
-            
-            elif re.match(r'^\d+\.', first_line):
-                # Numbered section
-                section_clean = escape_xml(section).replace('\n', '<br/>')
-                elements.append(Paragraph(section_clean, body_style))
+                    remaining_clean = _escape(remaining, line_breaks=True)
+                    body_parts.append(remaining_clean)
+                    body_chars = len(remaining_clean)
             
             else:
-                # Regular paragraph
-                section_clean = escape_xml(section).replace('\n', '<br/>')
-                elements.append(Paragraph(section_clean, body_style))
-            
-            elements.append(Spacer(1, 0.1 * inch))
+                # Numbered section or regular paragraph
+                section_clean = _escape(section, line_breaks=True)
+                if body_parts and body_chars + len(section_clean) > MAX_BLOCK_CHARS:
+                    _append(_Paragraph('<br/><br/>'.join(body_parts), body_style))
+                    body_parts = []
+                    body_chars = 0
+                body_parts.append(section_clean)
+                body_chars += len(section_clean)
+        
+        if body_parts:
+            _append(_Paragraph('<br/><br/>'.join(body_parts), body_style))
     
     # Build PDF
     doc.build(elements)
-    
-    # Get the value of the BytesIO buffer
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-    
-    return pdf_bytes
 
 
-def escape_xml(text):
-    """Escape special XML characters for reportlab"""
+def escape_xml(text, line_breaks=False):
+    """Escape special XML characters for reportlab, optionally converting newlines to <br/>"""
     if not text:
         return ""
     
-    text = str(text)
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    text = text.replace('"', '&quot;')
-    text = text.replace("'", '&apos;')
-    
-    return text
+    return str(text).translate(_XML_ESCAPE_BR if line_breaks else _XML_ESCAPE)
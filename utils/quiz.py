@@ -3,55 +3,58 @@ Quiz Generation and Management Module
 Handles question generation, storage, and quiz logic
 """
 
-import json
+import orjson
+import logging
 import random
-import time
-from litellm import completion
+import asyncio
+import numpy as np
+from utils.llm import (
+    acall_llm_with_retry,
+    call_llm_batch,
+    create_async_client,
+    truncate_to_tokens,
+    MAX_CONCURRENT_REQUESTS
+)
 
-# Model fallback chain
-MODEL_CHAIN = [
-    "gemini/gemini-2.5-flash-lite",
-    "gemini/gemini-2.0-flash", 
-]
+logger = logging.getLogger(__name__)
 
-def call_llm_with_retry(messages, temperature=0.7, max_tokens=3000, max_retries=3):
-    """Call LLM with retry logic and model fallback"""
-    
-    for model in MODEL_CHAIN:
-        for attempt in range(max_retries):
-            try:
-                response = completion(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                return response
-            
-            except Exception as e:
-                error_str = str(e)
-                
-                if "503" in error_str or "overloaded" in error_str.lower() or "429" in error_str:
-                    if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) * 2
-                        print(f"Model {model} busy, retrying in {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"Model {model} failed, trying next model...")
-                        break
-                
-                elif "404" in error_str or "not found" in error_str.lower():
-                    print(f"Model {model} not available, trying next model...")
-                    break
-                
-                else:
-                    if attempt == max_retries - 1:
-                        raise
-                    time.sleep(2)
-                    continue
-    
-    raise Exception("All models failed. Please check your API keys or try again later.")
+# Questions requested per LLM call; shards are generated concurrently
+QUESTIONS_PER_SHARD = 10
+
+# Token budget for the detailed notes in the shared question context
+DETAILED_NOTES_TOKENS = 2000
+
+# JSON schemas the question calls must follow (Gemini structured output)
+STEMS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "stems": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "topic": {"type": "string"},
+                    "stem": {"type": "string"}
+                },
+                "required": ["topic", "stem"]
+            }
+        }
+    },
+    "required": ["stems"]
+}
+
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}},
+        "correct_answer": {"type": "integer"},
+        "explanation": {"type": "string"},
+        "topic": {"type": "string"},
+        "difficulty": {"type": "string"}
+    },
+    "required": ["question", "options", "correct_answer", "explanation", "topic", "difficulty"]
+}
 
 
 def generate_questions(notes_data, num_questions=50, difficulty_mix=None):
@@ -79,17 +82,11 @@ def generate_questions(notes_data, num_questions=50, difficulty_mix=None):
                 'hard': num_questions - (2 * (num_questions // 3))
             }
         
-        all_questions = []
+        context = _build_notes_context(notes_data)
         
-        # Generate questions for each difficulty level
-        for difficulty, count in difficulty_mix.items():
-            if count > 0:
-                questions = _generate_questions_by_difficulty(
-                    notes_data, 
-                    difficulty, 
-                    count
-                )
-                all_questions.extend(questions)
+        # Outline every shard in one batch, then expand all stems concurrently
+        stems = generate_stems(context, _plan_shards(notes_data, difficulty_mix))
+        all_questions = asyncio.run(_aexpand_stems(context, stems))
         
         # Shuffle questions
         random.shuffle(all_questions)
@@ -107,22 +104,44 @@ def generate_questions(notes_data, num_questions=50, difficulty_mix=None):
         }
 
 
-def _generate_questions_by_difficulty(notes_data, difficulty, count):
-    """Generate questions of specific difficulty level"""
+def _plan_shards(notes_data, difficulty_mix):
+    """
+    Split each difficulty into shards over disjoint topic subsets
     
-    # Create context from notes
-    topics_text = "\n".join([
-        f"- {topic['name']}: {topic['description']}" 
-        for topic in notes_data['topics']
-    ])
+    Returns:
+        list: [(difficulty, count, topics), ...] where topics is None for unrestricted shards
+    """
+    topic_names = [topic['name'] for topic in notes_data['topics']]
+    shards = []
     
-    difficulty_instructions = {
-        'easy': 'Focus on basic definitions, facts, and direct recall from the lecture.',
-        'medium': 'Focus on understanding concepts and their relationships.',
-        'hard': 'Focus on application, analysis, and critical thinking.'
-    }
+    for difficulty, count in difficulty_mix.items():
+        if count <= 0:
+            continue
+        
+        num_shards = -(-count // QUESTIONS_PER_SHARD)
+        for shard in range(num_shards):
+            shard_count = count // num_shards + (1 if shard < count % num_shards else 0)
+            shard_topics = topic_names[shard::num_shards] if num_shards > 1 else None
+            shards.append((difficulty, shard_count, shard_topics or None))
+    
+    return shards
+
+
+def _build_notes_context(notes_data):
+    """
+    Format the system prompt shared by every question call
+    
+    Every outline and expansion call starts with this identical message, so
+    the notes form a common prompt prefix the provider can cache instead of
+    billing the full context on each call. Built once per generate_questions()
+    call and shared by reference.
+    """
+    topics_text = "\n".join(
+        f"- {topic['name']}: {topic['description']}"
+        for topic in notes_data['topics']
+    )
     
-    prompt = f"""You are an expert quiz creator. Generate {count} multiple-choice questions based on these lecture notes.
+    return f"""You are an expert quiz creator. All questions are based on these lecture notes.
 
 LECTURE SUMMARY:
 {notes_data['summary']}
@@ -134,63 +153,176 @@ TOPICS COVERED:
 {topics_text}
 
 DETAILED CONTENT:
-{notes_data['detailed_notes'][:2000]}  
+{truncate_to_tokens(notes_data['detailed_notes'], DETAILED_NOTES_TOKENS)}"""
+
+
+def generate_stems(context, shards):
+    """
+    Outline question stems for every shard
+    
+    Output tokens dominate latency, so questions are first outlined as compact
+    stems and only then expanded into full questions in parallel. All shard
+    outlines go out as one batch.
+    
+    Args:
+        context (str): Shared system prompt from _build_notes_context()
+        shards (list): [(difficulty, count, topics), ...] from _plan_shards()
+        
+    Returns:
+        list: [{'topic': str, 'stem': str, 'difficulty': str}, ...]
+    """
+    difficulty_instructions = {
+        'easy': 'Focus on basic definitions, facts, and direct recall from the lecture.',
+        'medium': 'Focus on understanding concepts and their relationships.',
+        'hard': 'Focus on application, analysis, and critical thinking.'
+    }
+    
+    message_lists = []
+    for difficulty, count, topics in shards:
+        # Restrict the shard to its own topics so parallel shards don't overlap
+        focus_text = f"\nONLY ask about these topics: {', '.join(topics)}\n" if topics else ""
+        
+        prompt = f"""Outline {count} multiple-choice questions based on the lecture notes.
 
 DIFFICULTY LEVEL: {difficulty.upper()}
 {difficulty_instructions[difficulty]}
+{focus_text}
+Return ONLY the question stems (no options, no answers) in this JSON format:
+{{"stems": [{{"topic": "Topic name from the notes", "stem": "What is...?"}}]}}
+
+Requirements:
+1. Topic must match one from the notes
+2. Questions should cover different topics
+3. Keep each stem to a single sentence"""
+        message_lists.append([
+            {"role": "system", "content": context},
+            {"role": "user", "content": prompt}
+        ])
+    
+    responses = call_llm_batch(
+        message_lists,
+        temperature=0.7,
+        max_tokens=600,
+        response_format={"type": "json_object", "response_schema": STEMS_SCHEMA}
+    )
+    
+    all_stems = []
+    for (difficulty, count, _), response in zip(shards, responses):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            
+            stems = orjson.loads(response.choices[0].message.content)['stems']
+            all_stems.extend({**stem, 'difficulty': difficulty} for stem in stems[:count])
+            
+        except Exception as e:
+            logger.warning("Error generating %s question stems: %s", difficulty, e)
+    
+    return all_stems
 
-Generate {count} questions following this EXACT JSON format:
-[
-    {{
-        "question": "What is...?",
-        "options": ["Option A", "Option B", "Option C", "Option D"],
-        "correct_answer": 0,
-        "explanation": "The answer is A because...",
-        "topic": "Topic name from the notes",
-        "difficulty": "{difficulty}"
-    }}
-]
+
+async def _aexpand_stems(context, stems):
+    """Expand all outlined stems concurrently, dropping any that fail or are invalid"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    client = create_async_client()
+    try:
+        questions = await asyncio.gather(*[
+            _expand_stem(context, stem, stem['difficulty'], semaphore=semaphore, client=client)
+            for stem in stems
+        ])
+    finally:
+        await client.close()
+    return [question for question in questions if question]
+
+
+async def _expand_stem(context, stem, difficulty, semaphore=None, client=None):
+    """Expand a single outlined stem into a full question with options and explanation"""
+    
+    prompt = f"""Turn this question stem into a multiple-choice question based on the lecture notes.
+
+QUESTION STEM: {stem['stem']}
+TOPIC: {stem['topic']}
+
+Return the question in this JSON format:
+{{
+    "question": "The question stem",
+    "options": ["Option A", "Option B", "Option C", "Option D"],
+    "correct_answer": 0,
+    "explanation": "The answer is A because...",
+    "topic": "The topic above",
+    "difficulty": "{difficulty}"
+}}
 
 Requirements:
-1. Each question must have exactly 4 options
+1. Exactly 4 options with plausible distractors
 2. correct_answer is the index (0-3) of the correct option
-3. Explanation should be clear and educational
-4. Topic must match one from the notes
-5. Questions should cover different topics
-6. Return ONLY valid JSON array, no other text
-
-IMPORTANT: Return ONLY the JSON array, nothing else."""
+3. Explanation should be clear, educational and brief"""
 
     try:
-        response = call_llm_with_retry(
-            messages=[{"role": "user", "content": prompt}],
+        response = await acall_llm_with_retry(
+            messages=[
+                {"role": "system", "content": context},
+                {"role": "user", "content": prompt}
+            ],
             temperature=0.7,
-            max_tokens=3000
+            # Headroom for long explanations; a reply cut off mid-JSON is dropped
+            max_tokens=500,
+            semaphore=semaphore,
+            client=client,
+            response_format={"type": "json_object", "response_schema": QUESTION_SCHEMA}
         )
         
-        content = response.choices[0].message.content
-        
-        # Clean up response
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
-        # Parse JSON
-        questions = json.loads(content)
-        
-        # Ensure it's a list
-        if isinstance(questions, dict):
-            questions = [questions]
-        
-        return questions
+        question = orjson.loads(response.choices[0].message.content)
         
+    except orjson.JSONDecodeError as e:
+        # Usually a reply cut off at max_tokens
+        logger.warning("Malformed %s question JSON, dropping it: %s", difficulty, e)
+        return None
     except Exception as e:
-        print(f"Error generating {difficulty} questions: {e}")
-        return []
+        logger.warning("Error expanding %s question stem: %s", difficulty, e)
+        return None
+    
+    if not _is_valid_question(question):
+        logger.warning("Dropping off-spec %s question: %r", difficulty, question)
+        return None
+    return question
+
+
+def _is_valid_question(question):
+    """Check a generated question has every field, exactly 4 options and an in-range answer"""
+    if not isinstance(question, dict):
+        return False
+    if not all(key in question for key in QUESTION_SCHEMA['required']):
+        return False
+    
+    options = question['options']
+    answer = question['correct_answer']
+    return (
+        isinstance(options, list)
+        and len(options) == 4
+        and isinstance(answer, int)
+        and not isinstance(answer, bool)
+        and 0 <= answer < len(options)
+    )
 
 
-def select_quiz_questions(all_questions, count=15, topics=None):
+def build_topic_index(all_questions):
+    """
+    Group a question pool by topic, once per pool
+    
+    Args:
+        all_questions (list): Pool of all available questions
+        
+    Returns:
+        dict: {topic: [question, ...]}
+    """
+    index = {}
+    for question in all_questions:
+        index.setdefault(question['topic'], []).append(question)
+    return index
+
+
+def select_quiz_questions(all_questions, count=15, topics=None, topic_index=None, seed=None):
     """
     Select random questions for a quiz session
     
@@ -198,20 +330,24 @@ def select_quiz_questions(all_questions, count=15, topics=None):
         all_questions (list): Pool of all available questions
         count (int): Number of questions to select
         topics (list): Specific topics to focus on (optional)
+        topic_index (dict): Output from build_topic_index(), so topic filtering
+            doesn't rescan the pool (optional)
+        seed (int): Seed for a reproducible selection (optional)
         
     Returns:
         list: Selected questions
     """
+    available = all_questions
     if topics:
         # Filter by topics
-        filtered = [q for q in all_questions if q['topic'] in topics]
+        if topic_index is None:
+            topic_index = build_topic_index(all_questions)
+        filtered = [q for topic in dict.fromkeys(topics) for q in topic_index.get(topic, ())]
         available = filtered if filtered else all_questions
-    else:
-        available = all_questions
     
-    # Shuffle and select
-    selected = random.sample(available, min(count, len(available)))
-    return selected
+    # Own generator when seeded, so reruns don't depend on global random state
+    rng = random.Random(seed) if seed is not None else random
+    return rng.sample(available, min(count, len(available)))
 
 
 def check_answer(question, user_answer):
@@ -250,24 +386,37 @@ def calculate_topic_performance(quiz_results):
     Returns:
         dict: {topic: {'correct': int, 'total': int, 'percentage': float}}
     """
-    topic_stats = {}
+    # Encode topics as ids (first-seen order) so tallies are vectorized bincounts
+    topic_ids = {}
+    ids = np.fromiter(
+        (topic_ids.setdefault(result['question']['topic'], len(topic_ids)) for result in quiz_results),
+        dtype=np.intp,
+        count=len(quiz_results)
+    )
+    is_correct = np.fromiter(
+        (result['is_correct'] for result in quiz_results),
+        dtype=np.bool_,
+        count=len(quiz_results)
+    )
     
-    for result in quiz_results:
-        topic = result['question']['topic']
-        
-        if topic not in topic_stats:
-            topic_stats[topic] = {'correct': 0, 'total': 0}
-        
-        topic_stats[topic]['total'] += 1
-        if result['is_correct']:
-            topic_stats[topic]['correct'] += 1
-    
-    # Calculate percentages
-    for topic, stats in topic_stats.items():
-        stats['percentage'] = (stats['correct'] / stats['total'] * 100) if stats['total'] > 0 else 0
-        stats['status'] = 'Strong' if stats['percentage'] >= 80 else 'Needs Review' if stats['percentage'] >= 60 else 'Weak'
+    totals = np.bincount(ids, minlength=len(topic_ids))
+    corrects = np.bincount(ids, weights=is_correct, minlength=len(topic_ids)).astype(np.intp)
+    percentages = corrects * 100 / np.maximum(totals, 1)
     
-    return topic_stats
+    return {
+        topic: {
+            'correct': int(corrects[i]),
+            'total': int(totals[i]),
+            'percentage': float(percentages[i]),
+            'status': _topic_status(percentages[i])
+        }
+        for topic, i in topic_ids.items()
+    }
+
+
+def _topic_status(percentage):
+    """Label a topic score for the results page"""
+    return 'Strong' if percentage >= 80 else 'Needs Review' if percentage >= 60 else 'Weak'
 
 
 def get_weak_topics(topic_performance, threshold=60):
@@ -281,16 +430,16 @@ def get_weak_topics(topic_performance, threshold=60):
     Returns:
         list: List of weak topics with details
     """
-    weak_topics = []
-    
-    for topic, stats in topic_performance.items():
-        if stats['percentage'] < threshold:
-            weak_topics.append({
-                'topic': topic,
-                'score': f"{stats['correct']}/{stats['total']}",
-                'percentage': stats['percentage'],
-                'status': stats['status']
-            })
+    weak_topics = [
+        {
+            'topic': topic,
+            'score': f"{stats['correct']}/{stats['total']}",
+            'percentage': stats['percentage'],
+            'status': stats['status']
+        }
+        for topic, stats in topic_performance.items()
+        if stats['percentage'] < threshold
+    ]
     
     # Sort by percentage (weakest first)
     weak_topics.sort(key=lambda x: x['percentage'])
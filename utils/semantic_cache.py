@@ -0,0 +1,103 @@
+"""
+Semantic Cache
+Matches new transcripts against previously processed ones so near-duplicate
+videos (re-uploads, mirrors) can reuse cached notes and questions
+"""
+
+import importlib.util
+import numpy as np
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+# Minimum cosine similarity for two transcripts to count as the same lecture
+SIMILARITY_THRESHOLD = 0.92
+
+# The model reads about 256 word pieces (~1000 characters) per input, so the
+# transcript is embedded as evenly spaced windows that are mean-pooled.
+# Embedding only the start would match lectures that share a boilerplate intro.
+WINDOW_CHARS = 1000
+MAX_WINDOWS = 16
+
+# A hit must also have a transcript of about the same length
+MIN_LENGTH_RATIO = 0.9
+
+_model = None
+
+
+def is_available():
+    """Check if sentence-transformers is installed (without importing it and torch)"""
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+def _get_model():
+    """Load the embedding model on first use"""
+    global _model
+    if _model is None:
+        # Optional dependency, imported here since it pulls in torch
+        from sentence_transformers import SentenceTransformer
+        _model = SentenceTransformer(EMBEDDING_MODEL)
+    return _model
+
+
+def embed_transcript(transcript):
+    """
+    Embed a transcript as the mean of evenly spaced windows across it
+
+    Args:
+        transcript (str): Full video transcript text
+
+    Returns:
+        list[float]: Unit-length embedding, or None if sentence-transformers is unavailable
+    """
+    if not is_available():
+        return None
+
+    last_start = max(len(transcript) - WINDOW_CHARS, 0)
+    num_windows = min(MAX_WINDOWS, max(1, -(-len(transcript) // WINDOW_CHARS)))
+    starts = np.linspace(0, last_start, num_windows, dtype=int)
+    windows = [transcript[start:start + WINDOW_CHARS] for start in starts]
+    
+    vectors = _get_model().encode(windows, normalize_embeddings=True)
+    vector = vectors.mean(axis=0)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def find_similar(embedding, index, threshold=SIMILARITY_THRESHOLD):
+    """
+    Find the most similar cached transcript
+
+    Args:
+        embedding (list[float]): Embedding from embed_transcript()
+        index (dict): {video_id: embedding} of cached sessions
+        threshold (float): Minimum cosine similarity for a hit
+
+    Returns:
+        str: Video ID of the best match, or None if nothing is similar enough
+    """
+    if embedding is None or not index:
+        return None
+
+    video_ids = list(index)
+    matrix = np.asarray([index[video_id] for video_id in video_ids], dtype=np.float32)
+
+    # Embeddings are normalized, so the dot product is the cosine similarity
+    scores = matrix @ np.asarray(embedding, dtype=np.float32)
+    best = int(np.argmax(scores))
+
+    return video_ids[best] if scores[best] >= threshold else None
+
+
+def confirm_match(transcript, cached_transcript, min_ratio=MIN_LENGTH_RATIO):
+    """
+    Second check on an embedding hit before reusing its notes and quiz
+    
+    Args:
+        transcript (str): Transcript of the requested video
+        cached_transcript (str): Transcript of the session find_similar() returned
+        min_ratio (float): Minimum shorter/longer length ratio
+        
+    Returns:
+        bool: True if the transcripts are about the same length
+    """
+    shorter, longer = sorted((len(transcript), len(cached_transcript)))
+    return longer > 0 and shorter / longer >= min_ratio
@@ -3,19 +3,79 @@ Data Storage and Session Management
 Handles caching and persistence of data during user session
 """
 
-import json
-import os
+import sqlite3
+import threading
+import gzip
+import logging
+import orjson
+import numpy as np
 from datetime import datetime
+from pathlib import Path
+
+try:
+    import zstandard as zstd
+except ImportError:
+    # Optional dependency: sessions are gzip-compressed without it
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
+# Transcripts are long, repetitive text that compresses 5-10x
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+DATA_DIR = Path("data")
+RESULTS_DIR = DATA_DIR / "results"
+
+# Created once at import (DATA_DIR along with it) instead of per instance or save
+RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def _compress(data):
+    """Compress session JSON with zstd if installed, otherwise gzip"""
+    if zstd is not None:
+        return zstd.compress(data, ZSTD_LEVEL)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _decompress(blob):
+    """Decompress a session blob, detecting the codec from its magic bytes"""
+    if blob.startswith(_GZIP_MAGIC):
+        return gzip.decompress(blob)
+    if blob.startswith(_ZSTD_MAGIC):
+        if zstd is None:
+            raise RuntimeError("Session was saved with zstd compression; install zstandard to read it")
+        return zstd.decompress(blob)
+    return blob
 
 
 class SessionStorage:
-    """Manages session data for quiz application"""
+    """Manages session data for quiz application (storage_dir must already exist)"""
     
-    def __init__(self, storage_dir="data"):
-        self.storage_dir = storage_dir
-        os.makedirs(storage_dir, exist_ok=True)
+    def __init__(self, storage_dir=DATA_DIR):
+        self.storage_dir = Path(storage_dir)
+        
+        # One connection shared by all Streamlit sessions; the lock serializes access
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.storage_dir / "sessions.db",
+            check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data BLOB NOT NULL, embedding BLOB)"
+            )
+            self._conn.commit()
+        
+        self._migrate_legacy_files()
     
-    def save_session(self, video_id, transcript, notes, questions):
+    def save_session(self, video_id, transcript, notes, questions, embedding=None):
         """Save complete session data"""
         session_data = {
             'video_id': video_id,
@@ -25,32 +85,83 @@ class SessionStorage:
             'questions': questions
         }
         
-        filepath = os.path.join(self.storage_dir, f"{video_id}.json")
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, indent=2, ensure_ascii=False)
-        
-        return filepath
+        self._write_session(video_id, session_data, embedding)
     
     def load_session(self, video_id):
         """Load session data if it exists"""
-        filepath = os.path.join(self.storage_dir, f"{video_id}.json")
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE id = ?", (video_id,)
+            ).fetchone()
         
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return None
+        if row is None:
+            return None
+        return orjson.loads(_decompress(row[0]))
     
     def session_exists(self, video_id):
-        """Check if session data exists"""
-        filepath = os.path.join(self.storage_dir, f"{video_id}.json")
-        return os.path.exists(filepath)
+        """Check if session data exists (a primary-key lookup, cheap enough not to cache)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sessions WHERE id = ?", (video_id,)
+            ).fetchone()
+        return row is not None
+    
+    def load_embedding_index(self):
+        """Load {video_id: embedding} for all sessions saved with an embedding"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM sessions WHERE embedding IS NOT NULL"
+            ).fetchall()
+        return {video_id: np.frombuffer(blob, dtype=np.float32) for video_id, blob in rows}
+    
+    def _write_session(self, video_id, session_data, embedding=None):
+        """Insert or replace a session as compressed JSON, with its embedding as float32 bytes"""
+        data = _compress(orjson.dumps(session_data))
+        embedding_blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, embedding) VALUES (?, ?, ?)",
+                (video_id, data, embedding_blob)
+            )
+            self._conn.commit()
+    
+    def _migrate_legacy_files(self):
+        """
+        Import sessions saved as .json / .json.gz / .json.zst files
+        
+        The files are left in place (the sample sessions are tracked in git),
+        so sessions already in the database are skipped and unreadable files
+        are logged and ignored.
+        """
+        with self._lock:
+            imported = {row[0] for row in self._conn.execute("SELECT id FROM sessions")}
+        
+        for filepath in self.storage_dir.iterdir():
+            filename = filepath.name
+            if filename.endswith((".json.zst", ".json.gz")):
+                video_id = filename.rsplit(".json.", 1)[0]
+            elif filename.endswith(".json") and filename != "embeddings.json":
+                video_id = filename[:-len(".json")]
+            else:
+                continue
+            
+            if video_id in imported:
+                continue
+            
+            try:
+                session_data = orjson.loads(_decompress(filepath.read_bytes()))
+                embedding = session_data.pop('embedding', None)
+                self._write_session(video_id, session_data, embedding)
+            except Exception as e:
+                logger.warning("Skipping unreadable session file %s: %s", filename, e)
+                continue
+            
+            imported.add(video_id)
 
 
 def save_quiz_results(video_id, results, score, topic_performance):
     """Save quiz results"""
-    results_dir = "data/results"
-    os.makedirs(results_dir, exist_ok=True)
-    
     result_data = {
         'video_id': video_id,
         'timestamp': datetime.now().isoformat(),
@@ -60,9 +171,7 @@ def save_quiz_results(video_id, results, score, topic_performance):
     }
     
     filename = f"{video_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    filepath = os.path.join(results_dir, filename)
-    
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(result_data, f, indent=2)
+    filepath = RESULTS_DIR / filename
+    filepath.write_bytes(orjson.dumps(result_data, option=orjson.OPT_INDENT_2))
     
-    return filepath
+    return str(filepath)
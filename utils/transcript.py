@@ -16,8 +16,23 @@ except ImportError:
     print("Then: pip install youtube-transcript-api")
     
 import re
+import functools
 
+# Video IDs are exactly 11 URL-safe characters
+_BARE_VIDEO_ID = re.compile(r'[A-Za-z0-9_-]{11}')
 
+# Matches the video ID in watch, short-link and embed URLs on YouTube hosts only
+_VIDEO_ID_PATTERN = re.compile(
+    r'^(?:https?://)?(?:[\w-]+\.)?'
+    r'(?:youtube\.com/(?:watch)?\?(?:[^#]*&)?v=|youtu\.be/|youtube\.com/embed/)'
+    r'([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])'
+)
+
+# Runs of whitespace (including newlines inside snippets) collapse to one space
+_WHITESPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=128)
 def extract_video_id(youtube_url):
     """
     Extract video ID from various YouTube URL formats
@@ -33,22 +48,14 @@ def extract_video_id(youtube_url):
     Returns:
         str: Video ID or None if invalid
     """
-    # Pattern to match various YouTube URL formats
-    patterns = [
-        r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([^&\n?#]+)',
-        r'youtube\.com/watch\?.*v=([^&\n?#]+)'
-    ]
+    youtube_url = youtube_url.strip()
     
-    for pattern in patterns:
-        match = re.search(pattern, youtube_url)
-        if match:
-            return match.group(1)
-    
-    # If no pattern matches, maybe it's just the video ID
-    if len(youtube_url) == 11 and not '/' in youtube_url:
+    # Cheap check first: maybe it's just the video ID
+    if len(youtube_url) == 11 and _BARE_VIDEO_ID.fullmatch(youtube_url):
         return youtube_url
-        
-    return None
+    
+    match = _VIDEO_ID_PATTERN.search(youtube_url)
+    return match.group(1) if match else None
 
 
 def get_transcript(youtube_url, language='en'):
@@ -78,27 +85,9 @@ def get_transcript(youtube_url, language='en'):
                 'error': 'Invalid YouTube URL. Please provide a valid video link.'
             }
         
-        # Create API instance and fetch transcript
-        api = YouTubeTranscriptApi()
-        transcript_data = api.fetch(video_id, [language, 'en'])
-        
-        # Get transcript snippets
-        snippets = transcript_data.snippets
-        
-        # Combine all transcript segments into one text
-        transcript_text = ' '.join([snippet.text for snippet in snippets])
-        
-        # Clean up transcript (remove extra spaces, newlines)
-        transcript_text = ' '.join(transcript_text.split())
-        
-        return {
-            'success': True,
-            'video_id': video_id,
-            'transcript': transcript_text,
-            'language': transcript_data.language,
-            'duration': snippets[-1].start + snippets[-1].duration if snippets else 0
-        }
-        
+        # Repeat requests (e.g. retrying after a failed generation) skip the download
+        return {'success': True, 'video_id': video_id, **_fetch_transcript(video_id, language)}
+    
     except TranscriptsDisabled:
         return {
             'success': False,
@@ -124,11 +113,36 @@ def get_transcript(youtube_url, language='en'):
         }
 
 
+@functools.lru_cache(maxsize=32)
+def _fetch_transcript(video_id, language):
+    """
+    Download and clean a transcript; successful fetches are memoized per process
+    
+    Raises the youtube_transcript_api errors handled by get_transcript().
+    """
+    # Create API instance and fetch transcript
+    api = YouTubeTranscriptApi()
+    transcript_data = api.fetch(video_id, [language, 'en'])
+    
+    # Get transcript snippets
+    snippets = transcript_data.snippets
+    
+    # Combine all transcript segments into one text and clean up extra spaces, newlines
+    transcript_text = _WHITESPACE.sub(' ', ' '.join(snippet.text for snippet in snippets)).strip()
+    
+    return {
+        'transcript': transcript_text,
+        'language': transcript_data.language,
+        'duration': snippets[-1].start + snippets[-1].duration if snippets else 0
+    }
+
+
 def get_video_metadata(video_id):
     """
     Get video metadata (title, duration, thumbnail)
     Note: This requires additional API or web scraping
-    For now, returns basic info
+    For now, returns basic info built from the video ID (no network calls);
+    the browser loads the thumbnail straight from YouTube's image CDN
     
     Args:
         video_id (str): YouTube video ID
@@ -139,7 +153,7 @@ def get_video_metadata(video_id):
     return {
         'video_id': video_id,
         'url': f'https://www.youtube.com/watch?v={video_id}',
-        'thumbnail': f'https://img.youtube.com/vi/{video_id}/maxresdefault.jpg',
+        'thumbnail': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg',
         'embed_url': f'https://www.youtube.com/embed/{video_id}'
     }
 